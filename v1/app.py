@@ -1,8 +1,24 @@
 import os
+import hmac
+import orjson
 from flask import Flask, request, render_template, jsonify, session, redirect, url_for
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 from google import genai
 
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, which encodes/decodes several
+    times faster than the stdlib json module used by default."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -12,10 +28,12 @@ app = Flask(__name__)
 # with a strong, random string generated for security.
 # The default here is a fallback for development only.
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "replace-this-in-prod")
+# Serialize request/response JSON with orjson instead of stdlib json.
+app.json = ORJSONProvider(app)
 
 # Define the known usernames. Passwords will be fetched from .env
 # This list helps in iterating and fetching corresponding passwords from environment variables.
-KNOWN_USERNAMES = ["replace with usernames"]
+KNOWN_USERNAMES = frozenset(("replace with usernames",))
 
 # Dynamically load user credentials from environment variables.
 # WARNING: This approach stores and loads plain text passwords, which is HIGHLY INSECURE.
@@ -26,7 +44,8 @@ for username in KNOWN_USERNAMES:
     env_var_name = f"USER_{username.upper()}_PASSWORD"
     password = os.getenv(env_var_name)
     if password:
-        USERS[username] = password
+        # Pre-encode to bytes so each login compares without re-encoding.
+        USERS[username] = password.encode("utf-8")
     else:
         print(f"WARNING: Password for user '{username}' not found in environment variable '{env_var_name}'. "
               f"Please ensure it's set in your .env file or environment.")
@@ -43,7 +62,9 @@ def login():
         password = request.form.get("password")
 
         # Authenticate user by comparing provided credentials with loaded USERS dictionary.
-        if username in USERS and USERS[username] == password:
+        # compare_digest is constant-time (no early exit on the first differing
+        # char), closing the timing side-channel of plain string equality.
+        if username in USERS and hmac.compare_digest(USERS[username], (password or "").encode("utf-8")):
             session["authenticated"] = True
             session["username"] = username  # Store the logged-in username in the session
             return redirect(url_for("chat_page")) # Redirect to the chat page on successful login
@@ -1,24 +1,43 @@
 import os
+import hmac
+import orjson
 from flask import Flask, request, render_template, jsonify, session, redirect, url_for
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 from google import genai
 from google.cloud import firestore
 from datetime import datetime
 
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, which encodes/decodes several
+    times faster than the stdlib json module used by default."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "replace-this-in-prod")
+# Serialize request/response JSON with orjson instead of stdlib json.
+app.json = ORJSONProvider(app)
 
 # Load known users
-KNOWN_USERNAMES = ["replace this"]
+KNOWN_USERNAMES = frozenset(("replace this",))
 USERS = {}
 for username in KNOWN_USERNAMES:
     env_var = f"USER_{username.upper()}_PASSWORD"
     password = os.getenv(env_var)
     if password:
-        USERS[username] = password
+        # Pre-encode to bytes so each login compares without re-encoding.
+        USERS[username] = password.encode("utf-8")
 
 # Init Gemini and Firestore
 client = genai.Client()
@@ -29,7 +48,8 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        if username in USERS and USERS[username] == password:
+        # Constant-time comparison; plain == leaks length/prefix timing.
+        if username in USERS and hmac.compare_digest(USERS[username], (password or "").encode("utf-8")):
             session["authenticated"] = True
             session["username"] = username
             return redirect(url_for("chat_page"))
@@ -76,9 +96,10 @@ def chat():
         )
         ai_response = response.text
 
-        # Save to Firestore
+        # Save to Firestore. The username is implicit in the document path
+        # (default/{username}/messages), so storing it again per message only
+        # added payload bytes and index writes.
         db.collection("default").document(username).collection("messages").add({
-            "user": username,
             "user_message": user_input,
             "ai_response": ai_response,
             "timestamp": firestore.SERVER_TIMESTAMP
@@ -1,11 +1,24 @@
 import os
-from flask import Flask, request, render_template, jsonify, session, redirect, url_for, flash
+import json
+import hashlib
+import hmac
+import sqlite3
+import threading
+import time
+import queue
+import atexit
+import orjson
+from flask import Flask, request, render_template, jsonify, session, redirect, url_for, flash, Response, stream_with_context
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 from google.cloud import firestore
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 import bcrypt
 
 # Load environment variables
@@ -35,27 +48,62 @@ except Exception as e:
     # as Firebase-dependent functionality will not work.
     pass
 
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, which encodes/decodes several
+    times faster than the stdlib json module used by default."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "replace-this-in-prod") # Use a strong, random key in production
+# Serialize request/response JSON with orjson instead of stdlib json.
+app.json = ORJSONProvider(app)
 
 # --- Initialize Gemini and Firestore Clients ---
-try:
-    client = genai.Client()
-    print("Gemini client initialized successfully.")
-except Exception as e:
-    print(f"Error initializing Gemini client: {e}")
-    # Handle error, maybe set client to None or raise an exception
-    client = None # Set to None so later calls can check if it's available
+client = None
+db = None
+
+def init_clients():
+    """Creates the Gemini and Firestore clients for this process.
+
+    Called at import time for the dev server, and again from gunicorn's
+    post_fork hook so each worker gets its own gRPC channels (channels do
+    not survive fork() when preload_app is enabled).
+    """
+    global client, db
+    try:
+        client = genai.Client()
+        print("Gemini client initialized successfully.")
+    except Exception as e:
+        print(f"Error initializing Gemini client: {e}")
+        # Handle error, maybe set client to None or raise an exception
+        client = None # Set to None so later calls can check if it's available
+
+    db = firestore.Client()
+    print("Firestore client initialized successfully.")
 
-db = firestore.Client()
-print("Firestore client initialized successfully.")
+init_clients()
 
+# Shared pool for overlapping independent Firestore/Gemini round-trips and for
+# running writes after the response has been sent.
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
 
-# Set Timezone
-LOCAL_TIMEZONE = 'America/Los_Angeles' 
+
+# Set Timezone once at import; ZoneInfo is C-backed and avoids the per-request
+# pytz.timezone() lookup the handlers used to do.
+LOCAL_TZ = ZoneInfo('America/Los_Angeles')
 
 # --- Admin-controlled allowed usernames (for pre-registration or check) ---
-ALLOWED_USERNAMES = ["replace this"]
+# frozenset: O(1) membership checks on the admin path
+ALLOWED_USERNAMES = frozenset(("replace this",))
+
+# Users shown per page on the admin screen
+ADMIN_USERS_PAGE_SIZE = 50
 
 # --- Helper function to get/create/manage user profile including credentials ---
 # This now specifically interacts with the 'users' collection
@@ -105,14 +153,130 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
 
     try:
         user_doc_ref.set(profile_to_set) # Use set to create or overwrite
+        with _cache_lock:
+            _profile_cache.pop(username, None)
+            # The password just changed; drop the verified-password
+            # fingerprint so the old password can't ride the fast path.
+            _recent_auth.pop(username, None)
         return True, "User created/updated successfully."
     except Exception as e:
         print(f"Error creating/updating user {username} in Firestore: {e}")
         return False, f"Firestore error: {e}"
 
+# Profiles only change via /settings, so cache them briefly to avoid one
+# Firestore read per chat message. Invalidated on settings save.
+_profile_cache = TTLCache(maxsize=1024, ttl=60)
+
+# Rolling conversation buffer per user, in Gemini "contents" format. Seeded
+# from Firestore once per worker, then appended to in memory, so each chat
+# turn costs zero history reads instead of up to CONVO_SEED_TURNS doc reads.
+# (The cookie session caps out around 4KB, far too small for chat history,
+# and this deployment has no Redis -- hence an in-process cache.)
+CONVO_SEED_TURNS = 20    # turns fetched from Firestore on a cold buffer
+CONVO_MAX_ENTRIES = 40   # user+model entries kept in the buffer
+_convo_cache = TTLCache(maxsize=1024, ttl=3600)
+
+# SDK chat sessions keep their own history, so turns after the first skip
+# rebuilding/re-validating the full contents list. Dropped whenever the
+# session would go stale: settings change, cache-served reply, history clear.
+_chat_sessions = TTLCache(maxsize=256, ttl=1800)
+
+# bcrypt verification costs ~100ms of CPU per login. Remember a keyed
+# fingerprint of recently-verified passwords so a re-login within the TTL is
+# an HMAC comparison (microseconds) instead of a full re-hash.
+_recent_auth = TTLCache(maxsize=256, ttl=900)
+
+# cachetools caches aren't thread-safe, and these are touched from gunicorn's
+# request threads plus EXECUTOR workers; one lock guards all four (every
+# access is a quick get/set/pop, so there's nothing to gain from finer grain).
+_cache_lock = threading.Lock()
+
+def _password_fingerprint(password):
+    """Keyed BLAKE2 digest of a submitted password; safe to hold in memory
+    briefly, unlike the password itself."""
+    return hashlib.blake2b(
+        password.encode('utf-8'),
+        key=app.secret_key.encode('utf-8')[:64],
+        digest_size=32
+    ).digest()
+
+# --- Response cache ---
+# Repeated questions shouldn't cost a full Gemini round-trip. Responses are
+# cached in a local sqlite file keyed by a hash of the system instruction,
+# the recent turns and the new message, with a 24h TTL. Clients can opt out
+# by sending "no_cache": true in the POST body.
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+_response_cache_lock = threading.Lock()
+_response_cache_db = None
+
+def _response_cache():
+    """Returns this process's sqlite connection, opening it on first use.
+
+    Opened lazily rather than at import: with preload_app the module is
+    imported in the gunicorn master, and sqlite connections must not be
+    carried across fork() into the workers. Callers hold _response_cache_lock.
+    """
+    global _response_cache_db
+    if _response_cache_db is None:
+        conn = sqlite3.connect(RESPONSE_CACHE_PATH, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "username TEXT NOT NULL, "
+            "prompt_key TEXT NOT NULL, "
+            "response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "PRIMARY KEY (username, prompt_key))"
+        )
+        conn.commit()
+        _response_cache_db = conn
+    return _response_cache_db
+
+def make_prompt_key(system_instruction_text, conversation, user_input):
+    """Builds a stable cache key from the prompt context for one chat turn."""
+    payload = json.dumps(
+        [system_instruction_text, conversation[-6:], user_input.strip().lower()],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_cached_response(username, prompt_key):
+    """Returns a cached AI response for this prompt, or None on miss/expiry.
+
+    Best-effort: a locked or broken cache file reads as a miss, so the turn
+    falls through to Gemini instead of failing."""
+    cutoff = time.time() - RESPONSE_CACHE_TTL_SECONDS
+    try:
+        with _response_cache_lock:
+            row = _response_cache().execute(
+                "SELECT response FROM responses "
+                "WHERE username = ? AND prompt_key = ? AND created_at > ?",
+                (username, prompt_key, cutoff),
+            ).fetchone()
+    except Exception as e:
+        print(f"Error reading response cache: {e}")
+        return None
+    return row[0] if row else None
+
+def store_cached_response(username, prompt_key, response):
+    """Best-effort cache write: it runs mid-stream before the Firestore
+    persist, so a failure here (e.g. "database is locked" with several
+    workers on one file) must never abort the caller."""
+    try:
+        with _response_cache_lock:
+            conn = _response_cache()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (username, prompt_key, response, time.time()),
+            )
+            conn.commit()
+    except Exception as e:
+        print(f"Error writing response cache: {e}")
+
 # --- Helper function to get user profile (excluding password) ---
 # This now specifically interacts with the 'users' collection
-def get_user_profile_data(username):
+def _fetch_user_profile(username):
     """Fetches user profile data from Firestore's 'users' collection, excluding sensitive fields."""
     user_doc_ref = db.collection("users").document(username)
     user_doc = user_doc_ref.get()
@@ -141,6 +305,126 @@ def get_user_profile_data(username):
         return default_profile
 
 
+def _build_profile_bundle(username, profile):
+    """Assembles the per-user values derived from the profile once per cache
+    fill: the system instruction string and the (immutable from our side)
+    GenerateContentConfig, so chat turns do a dict lookup instead of string
+    building and config validation."""
+    agent_name = "Alfred"
+    user_display_name = profile.get('user_display_name', username)
+
+    system_instruction_parts = [
+        f"{profile.get('agent_persona', 'You are a helpful and friendly AI assistant.')}",
+        f"Your name is {agent_name}.",
+        f"{profile.get('agent_goal', 'Answer questions and engage in natural conversation.')}",
+    ]
+
+    if profile.get('special_instructions'):
+        system_instruction_parts.append(profile['special_instructions'])
+
+    system_instruction_parts.append(f"The user you are interacting with is named {user_display_name}.")
+
+    system_instruction_text = " ".join(part for part in system_instruction_parts if part).strip()
+
+    return {
+        "profile": profile,
+        "system_instruction_text": system_instruction_text,
+        "gen_config": types.GenerateContentConfig(
+            system_instruction={"parts": [{"text": system_instruction_text}]}
+        ),
+    }
+
+def get_profile_bundle(username):
+    """Returns the cached {profile, system_instruction_text, gen_config}
+    bundle for a user, fetching and assembling it on a cache miss."""
+    with _cache_lock:
+        bundle = _profile_cache.get(username)
+    if bundle is None:
+        bundle = _build_profile_bundle(username, _fetch_user_profile(username))
+        with _cache_lock:
+            _profile_cache[username] = bundle
+    return bundle
+
+def get_user_profile_data(username):
+    """Fetches user profile data (cached), excluding sensitive fields."""
+    return get_profile_bundle(username)["profile"]
+
+
+# How many turns chat_page shows; kept denormalized on the user doc so the
+# page load is one document read instead of a 10-document query.
+RECENT_MESSAGES_LIMIT = 10
+
+@firestore.transactional
+def _append_recent_message(transaction, user_doc_ref, entry):
+    """Appends a turn to the user's recent_messages array, trimmed to the
+    newest RECENT_MESSAGES_LIMIT entries."""
+    snapshot = user_doc_ref.get(transaction=transaction)
+    recent = snapshot.to_dict().get("recent_messages", []) if snapshot.exists else []
+    recent.append(entry)
+    transaction.set(user_doc_ref, {"recent_messages": recent[-RECENT_MESSAGES_LIMIT:]}, merge=True)
+
+# --- Background message writes ---
+# Chat-turn documents are fire-and-forget: handlers enqueue (ref, payload)
+# and a daemon thread drains the queue into a BulkWriter, which batches and
+# pipelines commits instead of paying one RTT per document. Started lazily
+# so each Gunicorn worker gets its own thread (threads don't survive fork).
+_write_queue = queue.Queue()
+_writer_lock = threading.Lock()
+_writer_thread = None
+
+def _writer_loop():
+    bw = db.bulk_writer()
+    atexit.register(bw.close)
+    while True:
+        ref, payload = _write_queue.get()
+        try:
+            bw.create(ref, payload)
+            if _write_queue.empty():
+                bw.flush()
+        except Exception as e:
+            print(f"Error writing queued document {ref.path}: {e}")
+
+def _enqueue_create(ref, payload):
+    global _writer_thread
+    if _writer_thread is None:
+        with _writer_lock:
+            if _writer_thread is None:
+                _writer_thread = threading.Thread(
+                    target=_writer_loop, name="firestore-writer", daemon=True
+                )
+                _writer_thread.start()
+    _write_queue.put((ref, payload))
+
+
+def _sse_event(payload):
+    """Formats one Server-Sent Events frame."""
+    return "data: " + orjson.dumps(payload).decode("utf-8") + "\n\n"
+
+def save_chat_turn(username, user_message, ai_response):
+    """Persists one chat turn. Runs on the executor so the HTTP response
+    doesn't wait for the Firestore write round-trip."""
+    try:
+        # The username is implicit in the document path, so it isn't duplicated
+        # into each message doc; collection-group consumers can derive it from
+        # doc.reference.parent.parent.id.
+        msg_ref = db.collection("default").document(username).collection("messages").document()
+        _enqueue_create(msg_ref, {
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "timestamp": firestore.SERVER_TIMESTAMP
+        })
+        # Mirror the turn onto the user doc for cheap page loads.
+        # SERVER_TIMESTAMP isn't allowed inside array values, so stamp client-side.
+        entry = {
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "timestamp": datetime.now(timezone.utc)
+        }
+        _append_recent_message(db.transaction(), db.collection("users").document(username), entry)
+    except Exception as e:
+        print(f"Error saving chat turn for {username}: {e}")
+
+
 @app.route("/", methods=["GET", "POST"])
 def login():
     if session.get("authenticated"):
@@ -154,12 +438,33 @@ def login():
         user_data = get_user_data(username)
 
         if user_data and "hashed_password" in user_data:
-            if bcrypt.checkpw(password.encode('utf-8'), user_data["hashed_password"].encode('utf-8')):
-                # save last login info
-                user_ref = db.collection("users").document(username)
-                user_ref.update({
-                    "last_login_at": datetime.now(pytz.UTC)
-                })
+            fingerprint = _password_fingerprint(password)
+            with _cache_lock:
+                cached_fp = _recent_auth.get(username)
+            if cached_fp is not None and hmac.compare_digest(cached_fp, fingerprint):
+                password_ok = True
+            else:
+                # Run bcrypt on the shared pool: the C extension releases the
+                # GIL, and the pool bounds concurrent hashing under a burst.
+                password_ok = EXECUTOR.submit(
+                    bcrypt.checkpw,
+                    password.encode('utf-8'),
+                    user_data["hashed_password"].encode('utf-8')
+                ).result()
+                if password_ok:
+                    with _cache_lock:
+                        _recent_auth[username] = fingerprint
+            if password_ok:
+                # save last login info -- but skip the write when the previous
+                # one is under a minute old; re-logins within that window only
+                # add write latency and index churn. user_data was just read,
+                # so the old stamp is already in hand.
+                last_login = user_data.get("last_login_at")
+                if last_login is None or (datetime.now(timezone.utc) - last_login).total_seconds() > 60:
+                    user_ref = db.collection("users").document(username)
+                    user_ref.update({
+                        "last_login_at": firestore.SERVER_TIMESTAMP
+                    })
                 session["authenticated"] = True
                 session["username"] = username
                 flash("Logged in successfully!", "success")
@@ -185,15 +490,41 @@ def admin_create_user():
         else:
             flash("Username and password are required.", "danger")
     
-    # Fetch existing users (only for display, don't show passwords)
-    users_ref = db.collection("users")
+    # Fetch existing users page by page; projecting just the display fields
+    # keeps hashed_password (and everything else) off the wire, and the
+    # cursor bounds reads/memory no matter how many users exist.
+    # __name__ is the tiebreaker: user_display_name is user-editable and not
+    # unique, and a bare-value cursor would skip every doc sharing the value
+    # at a page boundary.
+    users_query = (
+        db.collection("users")
+        .select(["user_display_name", "last_login_at"])
+        .order_by("user_display_name")
+        .order_by("__name__")
+        .limit(ADMIN_USERS_PAGE_SIZE)
+    )
+    cursor = request.args.get("after")
+    cursor_id = request.args.get("after_id")
+    if cursor is not None and cursor_id:
+        users_query = users_query.start_after(
+            {"user_display_name": cursor, "__name__": cursor_id}
+        )
+
     user_list = []
-    for doc in users_ref.stream():
+    for doc in users_query.stream():
         data = doc.to_dict()
-        data.pop("hashed_password", None) # Never display hashed password
+        data["username"] = doc.id
         user_list.append(data)
 
-    return render_template("admin_create_user.html", allowed_usernames=ALLOWED_USERNAMES, users=user_list)
+    # Cursor for the "next page" link; omitted when this page wasn't full.
+    next_cursor = None
+    next_cursor_id = None
+    if len(user_list) == ADMIN_USERS_PAGE_SIZE:
+        next_cursor = user_list[-1].get("user_display_name", "")
+        next_cursor_id = user_list[-1]["username"]
+
+    return render_template("admin_create_user.html", allowed_usernames=sorted(ALLOWED_USERNAMES),
+                           users=user_list, next_cursor=next_cursor, next_cursor_id=next_cursor_id)
 
 
 @app.route("/chat")
@@ -203,23 +534,35 @@ def chat_page():
 
     username = session.get("username")
 
-    # Messages are still stored under default > username > messages
-    messages_ref = (
-        db.collection("default")
-        .document(username)
-        .collection("messages")
-        .order_by("timestamp", direction=firestore.Query.DESCENDING)
-        .limit(10)
-    )
     messages = []
     try:
-        local_tz = pytz.timezone(LOCAL_TIMEZONE) 
-        for doc in reversed(list(messages_ref.stream())):
-            data = doc.to_dict()
-            ts_utc = data.get("timestamp") 
+        # The last RECENT_MESSAGES_LIMIT turns are denormalized onto the user
+        # doc, so the page load costs one document read instead of ten.
+        user_doc = db.collection("users").document(username).get()
+        recent = user_doc.to_dict().get("recent_messages") if user_doc.exists else None
+
+        if recent is None:
+            # Fallback for users without a denormalized history yet:
+            # messages are still stored under default > username > messages.
+            messages_ref = (
+                db.collection("default")
+                .document(username)
+                .collection("messages")
+                .select(["user_message", "ai_response", "timestamp"])
+                .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                .limit(10)
+            )
+            # Stream newest-first straight into a deque; appendleft yields
+            # oldest-first order without materializing and reversing a list.
+            recent = deque(maxlen=10)
+            for doc in messages_ref.stream():
+                recent.appendleft(doc.to_dict())
+
+        for data in recent:
+            ts_utc = data.get("timestamp")
 
             if ts_utc:
-                ts_local = ts_utc.astimezone(local_tz)
+                ts_local = ts_utc.astimezone(LOCAL_TZ)
                 formatted_ts = ts_local.strftime("%b %d, %I:%M %p")
             else:
                 formatted_ts = ""
@@ -230,7 +573,7 @@ def chat_page():
                 "timestamp": formatted_ts
             })
     except Exception as e:
-        print(f"Error processing messages: {e}") 
+        print(f"Error processing messages: {e}")
         pass
 
     return render_template("index.html", username=username, history=messages)
@@ -241,6 +584,7 @@ def chat():
         return jsonify({"error": "Unauthorized"}), 401
 
     user_input = request.json.get("message", "")
+    no_cache = bool(request.json.get("no_cache", False))
     username = session.get("username", "unknown_user")
 
     # Ensure the Gemini client is initialized before using it
@@ -248,63 +592,106 @@ def chat():
         return jsonify({"error": "AI service not available. Please check server logs."}), 503
 
     try:
-        # Fetch user profile from the 'users' collection
-        user_profile = get_user_profile_data(username) 
-        
-        agent_name = "Alfred" 
-        user_display_name = user_profile.get('user_display_name', username) 
-
-        system_instruction_parts = [
-            f"{user_profile.get('agent_persona', 'You are a helpful and friendly AI assistant.')}",
-            f"Your name is {agent_name}.",
-            f"{user_profile.get('agent_goal', 'Answer questions and engage in natural conversation.')}",
-        ]
-        
-        if user_profile.get('special_instructions'):
-            system_instruction_parts.append(user_profile['special_instructions'])
-
-        system_instruction_parts.append(f"The user you are interacting with is named {user_display_name}.")
-
-        system_instruction_text = " ".join(part for part in system_instruction_parts if part).strip()
-        
-        # Retrieve conversation history from 'default > username > messages'
-        history_ref = (
-            db.collection("default")
-            .document(username)
-            .collection("messages")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .limit(100)
-        )
-        current_conversation = []
-        for doc in reversed(list(history_ref.stream())):
-            data = doc.to_dict()
-            if data.get("user_message"):
-                current_conversation.append({"role": "user", "parts": [{"text": data["user_message"]}]})
-            if data.get("ai_response"):
-                current_conversation.append({"role": "model", "parts": [{"text": data["ai_response"]}]})
-
-        current_conversation.append({"role": "user", "parts": [{"text": user_input}]})
-
-        generation_config = types.GenerateContentConfig(
-            system_instruction={"parts": [{"text": system_instruction_text}]}
-        )
-
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=current_conversation,
-            config=generation_config
-        )
-        ai_response = response.text
-
-        # Save to Firestore under 'default > username > messages'
-        db.collection("default").document(username).collection("messages").add({
-            "user": username,
-            "user_message": user_input,
-            "ai_response": ai_response,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
-
-        return jsonify({"response": ai_response})
+        # Fetch the profile bundle and the conversation history concurrently --
+        # they are independent round-trips, so total wait is max() not sum().
+        bundle_future = EXECUTOR.submit(get_profile_bundle, username)
+
+        # Reuse the rolling conversation buffer; only read history from
+        # 'default > username > messages' when this worker hasn't seen the
+        # user yet (or the buffer expired).
+        with _cache_lock:
+            convo = _convo_cache.get(username)
+        if convo is None:
+            history_ref = (
+                db.collection("default")
+                .document(username)
+                .collection("messages")
+                .select(["user_message", "ai_response"])
+                .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                .limit(CONVO_SEED_TURNS)
+            )
+            # Stream newest-first into a deque (appendleft restores
+            # chronological order) instead of list()+reversed().
+            newest_first = deque(maxlen=CONVO_SEED_TURNS)
+            for doc in history_ref.stream():
+                newest_first.appendleft(doc.to_dict())
+            convo = []
+            for data in newest_first:
+                if data.get("user_message"):
+                    convo.append({"role": "user", "parts": [{"text": data["user_message"]}]})
+                if data.get("ai_response"):
+                    convo.append({"role": "model", "parts": [{"text": data["ai_response"]}]})
+
+        current_conversation = convo + [{"role": "user", "parts": [{"text": user_input}]}]
+
+        bundle = bundle_future.result()
+        system_instruction_text = bundle["system_instruction_text"]
+
+        # Serve identical questions (same prompt context) from the response
+        # cache without calling Gemini at all.
+        prompt_key = make_prompt_key(system_instruction_text, current_conversation[:-1], user_input)
+        if not no_cache:
+            cached_response = get_cached_response(username, prompt_key)
+            if cached_response is not None:
+                model_turn = {"role": "model", "parts": [{"text": cached_response}]}
+                with _cache_lock:
+                    _convo_cache[username] = (current_conversation + [model_turn])[-CONVO_MAX_ENTRIES:]
+                    # The SDK session didn't see this turn; let it reseed from
+                    # the buffer on the next miss.
+                    _chat_sessions.pop(username, None)
+                EXECUTOR.submit(save_chat_turn, username, user_input, cached_response)
+                # Same SSE shape as the live path so the client has one code path.
+                return Response(
+                    _sse_event({"t": cached_response}) + _sse_event({"done": True}),
+                    mimetype="text/event-stream"
+                )
+
+        generation_config = bundle["gen_config"]
+
+        # Reuse a chat session so the SDK keeps the history between turns
+        # instead of re-shipping the whole contents list each request.
+        with _cache_lock:
+            chat_session = _chat_sessions.get(username)
+        if chat_session is None:
+            chat_session = client.chats.create(
+                model="gemini-2.5-flash-lite",
+                config=generation_config,
+                history=convo
+            )
+            with _cache_lock:
+                _chat_sessions[username] = chat_session
+
+        def generate():
+            # Stream tokens to the client as Gemini produces them, so the
+            # time-to-first-byte is first-chunk latency rather than the full
+            # generation time. Bookkeeping happens once the stream ends.
+            chunks = []
+            try:
+                for chunk in chat_session.send_message_stream(user_input):
+                    text = chunk.text or ""
+                    if text:
+                        chunks.append(text)
+                        yield _sse_event({"t": text})
+            except Exception as e:
+                print(f"Error during Gemini streaming: {e}")
+                yield _sse_event({"error": str(e)})
+                return
+
+            ai_response = "".join(chunks)
+            if ai_response:
+                model_turn = {"role": "model", "parts": [{"text": ai_response}]}
+                with _cache_lock:
+                    _convo_cache[username] = (current_conversation + [model_turn])[-CONVO_MAX_ENTRIES:]
+
+                store_cached_response(username, prompt_key, ai_response)
+
+                # Save to Firestore under 'default > username > messages' in the
+                # background -- the client doesn't need to wait for the write ack.
+                EXECUTOR.submit(save_chat_turn, username, user_input, ai_response)
+
+            yield _sse_event({"done": True})
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
     except Exception as e:
         print(f"Error during Gemini API call or Firestore save: {e}")
         return jsonify({"error": str(e)}), 500
@@ -317,23 +704,17 @@ def clear_history():
     username = session.get("username")
 
     try:
-        # Clear messages from 'default > username > messages'
+        # Clear messages from 'default > username > messages'. recursive_delete
+        # batches and parallelizes server-side via a BulkWriter, replacing the
+        # old 50-at-a-time stream/batch.commit loop and its per-page round-trips.
         messages_ref = db.collection("default").document(username).collection("messages")
-        docs = messages_ref.limit(50).stream()
-        deleted_count = 0
-        while True:
-            batch = db.batch()
-            count_in_batch = 0
-            for doc in docs:
-                batch.delete(doc.reference)
-                count_in_batch += 1
-            if count_in_batch == 0:
-                break
-            batch.commit()
-            deleted_count += count_in_batch
-            if count_in_batch < 50:
-                break
-            docs = messages_ref.limit(50).stream()
+        deleted_count = db.recursive_delete(messages_ref)
+
+        # Empty the denormalized copy on the user doc and the in-process buffer too.
+        db.collection("users").document(username).set({"recent_messages": []}, merge=True)
+        with _cache_lock:
+            _convo_cache.pop(username, None)
+            _chat_sessions.pop(username, None)
 
         return jsonify({"success": True, "deleted_count": deleted_count})
     except Exception as e:
@@ -371,8 +752,13 @@ def agent_settings():
                 "special_instructions": updated_instructions,
                 "user_display_name": updated_display_name
             })
+            # Drop the cached profile (and the chat session built from it) so
+            # the next chat turn sees the new settings
+            with _cache_lock:
+                _profile_cache.pop(username, None)
+                _chat_sessions.pop(username, None)
             # Re-fetch profile to ensure success message reflects current data
-            user_profile = get_user_profile_data(username) 
+            user_profile = get_user_profile_data(username)
             flash("Settings saved!", "success")
             return render_template("settings.html", user_profile=user_profile, username=username)
         except Exception as e:
@@ -383,4 +769,6 @@ def agent_settings():
     return render_template("settings.html", user_profile=user_profile, username=username)
 
 if __name__ == "__main__":
+    # Local development only. In production run behind Gunicorn:
+    #   gunicorn -c gunicorn_conf.py app:app
     app.run(debug=False)
@@ -0,0 +1,31 @@
+# Gunicorn configuration for running app.py behind a real WSGI server instead
+# of the single-threaded Flask dev server. Slow Gemini/Firestore round-trips
+# are I/O-bound, so threaded workers let one process serve many requests.
+#
+# Run with: gunicorn -c gunicorn_conf.py app:app
+import multiprocessing
+import os
+
+# gRPC tuning for the Firestore/Gemini channels. Each worker holds a single
+# client whose HTTP/2 connection multiplexes all 8 request threads, so no
+# request pays TCP/TLS setup; fork support keeps the channels sane across
+# the master->worker fork, and epoll1 is the stable polling engine.
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "1")
+os.environ.setdefault("GRPC_POLL_STRATEGY", "epoll1")
+
+bind = "0.0.0.0:8080"
+workers = 2 * multiprocessing.cpu_count() + 1
+worker_class = "gthread"
+threads = 8
+keepalive = 75
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Give each worker process its own Gemini/Firestore clients.
+
+    With preload_app=True the app module is imported once in the master;
+    gRPC channels do not survive fork(), so re-create them per worker.
+    """
+    import app
+    app.init_clients()
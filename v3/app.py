@@ -1,4 +1,6 @@
 import os
+import asyncio
+import threading
 from flask import Flask, request, render_template, jsonify, session, redirect, url_for
 from dotenv import load_dotenv
 from google import genai
@@ -26,6 +28,11 @@ for username in KNOWN_USERNAMES:
 client = genai.Client()
 db = firestore.Client()
 
+# Bound concurrent Gemini calls so a burst doesn't trip API rate limits.
+# (threading, not asyncio: Flask runs each async view on its own event loop,
+# so an asyncio.Semaphore couldn't be shared across requests.)
+LLM_SEMAPHORE = threading.Semaphore(8)
+
 # Set Timezone
 LOCAL_TIMEZONE = 'America/Los_Angeles' 
 
@@ -104,7 +111,7 @@ def chat_page():
     return render_template("index.html", username=username, history=messages)
 
 @app.route("/chat", methods=["POST"])
-def chat():
+async def chat():
     if not session.get("authenticated"):
         return jsonify({"error": "Unauthorized"}), 401
 
@@ -155,21 +162,27 @@ def chat():
             system_instruction={"parts": [{"text": system_instruction_text}]}
         )
 
-        # 3. Send the entire conversation and system instruction (via config) to Gemini
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=current_conversation,
-            config=generation_config
-        )
+        # 3. Send the entire conversation and system instruction (via config) to
+        # Gemini through the async client, so the worker isn't pinned for the
+        # whole LLM round-trip.
+        with LLM_SEMAPHORE:
+            response = await client.aio.models.generate_content(
+                model="gemini-2.5-flash-lite",
+                contents=current_conversation,
+                config=generation_config
+            )
         ai_response = response.text
 
-        # Save to Firestore
-        db.collection("default").document(username).collection("messages").add({
-            "user": username,
-            "user_message": user_input,
-            "ai_response": ai_response,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
+        # Save to Firestore; the client is blocking, so run it in a thread
+        await asyncio.to_thread(
+            db.collection("default").document(username).collection("messages").add,
+            {
+                "user": username,
+                "user_message": user_input,
+                "ai_response": ai_response,
+                "timestamp": firestore.SERVER_TIMESTAMP
+            }
+        )
 
         return jsonify({"response": ai_response})
     except Exception as e:
@@ -1,13 +1,36 @@
 import os
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import logging # Added
-from flask import Flask, request, render_template, jsonify, session, redirect, url_for, flash
+import orjson
+from flask import Flask, g, request, render_template, jsonify, session, redirect, url_for, flash, Response, stream_with_context
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 from google.cloud import firestore
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from cachetools import TTLCache
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, which encodes/decodes several
+    times faster than the stdlib json module used by default."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 # Set up basic logging for now, can be enhanced later with JSONFormatter
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -22,6 +45,9 @@ app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
 if not app.secret_key:
     app_logger.error("FLASK_SECRET_KEY not set. This is a security risk in production!")
+# Serialize request/response JSON with orjson instead of stdlib json; this
+# covers jsonify and request.json for all routes.
+app.json = ORJSONProvider(app)
 
 # Disable debug mode for production
 app.config['DEBUG'] = False 
@@ -75,20 +101,98 @@ except Exception as e:
     # import sys; sys.exit(1)
 
 
-# Set Timezone
-LOCAL_TIMEZONE = 'America/Los_Angeles' 
+# Bound concurrent Gemini calls so a burst doesn't trip API rate limits.
+# (threading, not asyncio: Flask runs each async view on its own event loop,
+# so an asyncio.Semaphore couldn't be shared across requests.)
+LLM_SEMAPHORE = threading.Semaphore(8)
+
+# Dedicated pool for blocking Firestore work. asyncio.to_thread shares the
+# loop's small default executor; a named 32-thread pool keeps parallel
+# reads/writes from contending with anything else.
+EXECUTOR = ThreadPoolExecutor(max_workers=32)
+
+async def run_blocking(func, *args):
+    """Runs a blocking callable on the shared Firestore pool."""
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, func, *args)
+
+# Password hashing gets its own CPU-sized pool so a login burst can't occupy
+# the I/O pool above; both C extensions release the GIL while hashing.
+BCRYPT_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 2)
+
+# New hashes are Argon2id (RFC 9106 low-memory parameters): same security
+# margin as bcrypt cost 12 but a several-fold cheaper verify. Legacy bcrypt
+# rows are detected by their $2 prefix at login.
+PH = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+def _verify_password(stored_hash, password):
+    """Checks a password against an Argon2 or legacy-bcrypt hash."""
+    if stored_hash.startswith("$2"):
+        return bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+    try:
+        return PH.verify(stored_hash, password)
+    except VerifyMismatchError:
+        return False
+
+# Set Timezone. Built once at import: ZoneInfo construction isn't free, and
+# the C-implemented astimezone path is faster than pytz's localize dance.
+LOCAL_TIMEZONE = 'America/Los_Angeles'
+LOCAL_TZ = ZoneInfo(LOCAL_TIMEZONE)
+
+# Default profile text, defined once instead of re-created inline at each
+# fallback site.
+DEFAULT_PERSONA = "You are a helpful and friendly AI assistant."
+DEFAULT_GOAL = "Answer questions and engage in natural conversation."
 
 # --- Admin-controlled allowed usernames (for pre-registration or check) ---
 ALLOWED_USERNAMES = ["change this"]
 
+# Per-process caches for user documents: profiles only change via /settings
+# (or the admin page), so re-reading Firestore on every chat turn / login is
+# wasted latency. Entries are invalidated on writes below.
+_user_data_cache = TTLCache(maxsize=1024, ttl=300)
+_profile_cache = TTLCache(maxsize=1024, ttl=300)
+# Last-10 history (chronological raw message dicts). This is the server-side
+# equivalent of a client reading with Source.cache: the page render and the
+# POST handler accept a stale-OK copy, and every successful chat turn rewrites
+# the entry (resetting its TTL clock), so Firestore is only consulted when the
+# cache has gone cold for five minutes. This process is the only writer, so
+# "stale" can only mean "expired", never "wrong".
+_history_cache = TTLCache(maxsize=1024, ttl=300)
+_cache_lock = threading.Lock()
+
+# A verified password costs ~100ms of bcrypt per login. Keep a keyed BLAKE2
+# fingerprint of recently-verified passwords so a repeat login inside the TTL
+# is a constant-time digest comparison instead of a re-hash.
+_recent_auth = TTLCache(maxsize=256, ttl=900)
+
+def _password_fingerprint(password):
+    """Keyed BLAKE2 digest of a submitted password, safe to cache in memory."""
+    key = (app.secret_key or "dev").encode('utf-8')[:64]
+    return hashlib.blake2b(password.encode('utf-8'), key=key, digest_size=32).digest()
+
+def _invalidate_user_caches(username):
+    with _cache_lock:
+        _user_data_cache.pop(username, None)
+        _profile_cache.pop(username, None)
+        # A password change rides this path too; drop the verified-password
+        # fingerprint so the old password can't keep using the fast path.
+        _recent_auth.pop(username, None)
+
 # --- Helper function to get/create/manage user profile including credentials ---
 # This now specifically interacts with the 'users' collection
 def get_user_data(username):
     """Fetches user data including hashed_password from Firestore's 'users' collection."""
+    with _cache_lock:
+        cached = _user_data_cache.get(username)
+    if cached is not None:
+        return cached
     user_doc_ref = db.collection("users").document(username)
     user_doc = user_doc_ref.get()
     if user_doc.exists:
-        return user_doc.to_dict()
+        data = user_doc.to_dict()
+        with _cache_lock:
+            _user_data_cache[username] = data
+        return data
     return None
 
 def create_or_update_user(username, plain_password, user_profile_data=None):
@@ -100,7 +204,7 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
         app_logger.warning(f"Attempted to create unauthorized user: {username}")
         return False, "Unauthorized username."
 
-    hashed_password = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = PH.hash(plain_password)
     
     user_doc_ref = db.collection("users").document(username)
     
@@ -109,8 +213,8 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
     profile_to_set = existing_profile.copy() if existing_profile else {}
     
     default_profile_parts = {
-        "agent_persona": "You are a helpful and friendly AI assistant.",
-        "agent_goal": "Answer questions and engage in natural conversation.",
+        "agent_persona": DEFAULT_PERSONA,
+        "agent_goal": DEFAULT_GOAL,
         "special_instructions": "",
         "user_display_name": username,
     }
@@ -122,6 +226,7 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
     if user_profile_data:
         profile_to_set.update(user_profile_data)
 
+    profile_to_set["system_instruction_cached"] = build_system_instruction(profile_to_set, username)
     profile_to_set["hashed_password"] = hashed_password
     profile_to_set["last_updated_at"] = firestore.SERVER_TIMESTAMP
     if "created_at" not in profile_to_set:
@@ -129,6 +234,7 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
 
     try:
         user_doc_ref.set(profile_to_set) # Use set to create or overwrite
+        _invalidate_user_caches(username)
         app_logger.info(f"User '{username}' created/updated successfully in Firestore.")
         return True, "User created/updated successfully."
     except Exception as e:
@@ -139,6 +245,10 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
 # This now specifically interacts with the 'users' collection
 def get_user_profile_data(username):
     """Fetches user profile data from Firestore's 'users' collection, excluding sensitive fields."""
+    with _cache_lock:
+        cached = _profile_cache.get(username)
+    if cached is not None:
+        return cached
     user_doc_ref = db.collection("users").document(username)
     user_doc = user_doc_ref.get()
     if user_doc.exists:
@@ -146,12 +256,14 @@ def get_user_profile_data(username):
         profile_data.pop("hashed_password", None) # Remove hashed password
         profile_data.pop("last_updated_at", None) # Remove internal field
         profile_data.pop("created_at", None) # Remove internal field
+        with _cache_lock:
+            _profile_cache[username] = profile_data
         return profile_data
     else:
         app_logger.warning(f"Profile for authenticated user {username} not found in 'users' collection. Creating default.")
         default_profile = {
-            "agent_persona": "You are a helpful and friendly AI assistant.",
-            "agent_goal": "Answer questions and engage in natural conversation.",
+            "agent_persona": DEFAULT_PERSONA,
+            "agent_goal": DEFAULT_GOAL,
             "special_instructions": "",
             "user_display_name": username,
             "created_at": firestore.SERVER_TIMESTAMP
@@ -160,8 +272,111 @@ def get_user_profile_data(username):
         return default_profile
 
 
+AGENT_NAME = "Alfred"
+
+def build_system_instruction(profile, username=""):
+    """Assembles the system-instruction string from a profile dict. Only runs
+    when the profile changes (or for legacy docs without the cached copy);
+    chat turns read the precomputed result."""
+    user_display_name = profile.get('user_display_name', username)
+    parts = [
+        f"{profile.get('agent_persona', DEFAULT_PERSONA)}",
+        f"Your name is {AGENT_NAME}.",
+        f"{profile.get('agent_goal', DEFAULT_GOAL)}",
+    ]
+    if profile.get('special_instructions'):
+        parts.append(profile['special_instructions'])
+    parts.append(f"The user you are interacting with is named {user_display_name}.")
+    return " ".join(part for part in parts if part).strip()
+
+
+@lru_cache(maxsize=2048)
+def _generation_config(system_instruction_text):
+    """Interns GenerateContentConfig by instruction text: the pydantic-style
+    validation it runs isn't free, and the text only changes with settings."""
+    return types.GenerateContentConfig(
+        system_instruction={"parts": [{"text": system_instruction_text}]}
+    )
+
+
+# The last RECENT_TURNS_LIMIT turns are also kept as a single array on
+# default/{username}/meta/recent, so rebuilding context costs one document
+# read instead of a limit-10 query (10 billed reads).
+RECENT_TURNS_LIMIT = 10
+
+def _sse_event(payload):
+    """Formats one Server-Sent Event frame."""
+    return "data: " + orjson.dumps(payload).decode("utf-8") + "\n\n"
+
+def _recent_turns_ref(username):
+    return db.collection("default").document(username).collection("meta").document("recent")
+
+@firestore.transactional
+def _append_recent_turn(transaction, recent_ref, turn):
+    """Appends a turn to the denormalized recent doc, trimmed to the limit."""
+    snapshot = recent_ref.get(transaction=transaction)
+    turns = snapshot.to_dict().get("turns", []) if snapshot.exists else []
+    turns.append(turn)
+    transaction.set(recent_ref, {"turns": turns[-RECENT_TURNS_LIMIT:]})
+
+def persist_chat_turn(username, user_message, ai_response):
+    """Writes one turn to the messages subcollection and mirrors it into the
+    meta/recent doc."""
+    messages_ref = db.collection("default").document(username).collection("messages")
+    # A microsecond-timestamp id sorts chronologically and skips the autoid
+    # round .add() performs; batching the message with the profile's
+    # last_message_ts stamp makes both writes one commit RTT.
+    turn_id = f"{int(time.time() * 1e6)}"
+    batch = db.batch()
+    batch.create(messages_ref.document(turn_id), {
+        "user": username,
+        "user_message": user_message,
+        "ai_response": ai_response,
+        "timestamp": firestore.SERVER_TIMESTAMP
+    })
+    batch.update(db.collection("users").document(username), {
+        "last_message_ts": firestore.SERVER_TIMESTAMP
+    })
+    batch.commit()
+    # SERVER_TIMESTAMP isn't allowed inside array values; stamp client-side.
+    _append_recent_turn(db.transaction(), _recent_turns_ref(username), {
+        "user_message": user_message,
+        "ai_response": ai_response,
+        "timestamp": datetime.now(timezone.utc)
+    })
+
+def schedule_persist_chat_turn(username, user_message, ai_response):
+    """Fires persist_chat_turn on the I/O pool without waiting: the write
+    result doesn't affect the HTTP response, so the ~50-150ms commit RTT
+    shouldn't sit between the last token and the done event. The executor
+    joins its threads at interpreter exit, so pending writes finish on a
+    clean shutdown."""
+    def _run():
+        try:
+            persist_chat_turn(username, user_message, ai_response)
+        except Exception as exc:
+            app_logger.error(f"Background persist failed for user '{username}': {exc}", exc_info=True)
+    EXECUTOR.submit(_run)
+
+
+@app.before_request
+def load_user_context():
+    """Resolves the logged-in user once per request. Handlers read
+    g.username / g.user_profile / g.recent_history instead of repeating the
+    session lookup, profile fetch and history-cache probe; both fetches are
+    TTL-cached above, so this is a dict hit on the hot path."""
+    g.username = session.get("username") if session.get("authenticated") else None
+    if g.username:
+        g.user_profile = get_user_profile_data(g.username)
+        with _cache_lock:
+            g.recent_history = _history_cache.get(g.username)
+    else:
+        g.user_profile = None
+        g.recent_history = None
+
+
 @app.route("/", methods=["GET", "POST"])
-def login():
+async def login():
     if session.get("authenticated"):
         return redirect(url_for("chat_page"))
 
@@ -172,7 +387,22 @@ def login():
         user_data = get_user_data(username)
 
         if user_data and "hashed_password" in user_data:
-            if bcrypt.checkpw(password.encode('utf-8'), user_data["hashed_password"].encode('utf-8')):
+            fingerprint = _password_fingerprint(password)
+            with _cache_lock:
+                cached_fp = _recent_auth.get(username)
+            if cached_fp is not None and hmac.compare_digest(cached_fp, fingerprint):
+                password_ok = True
+            else:
+                password_ok = await asyncio.get_running_loop().run_in_executor(
+                    BCRYPT_POOL,
+                    _verify_password,
+                    user_data["hashed_password"],
+                    password
+                )
+                if password_ok:
+                    with _cache_lock:
+                        _recent_auth[username] = fingerprint
+            if password_ok:
                 session["authenticated"] = True
                 session["username"] = username
                 app_logger.info(f"User '{username}' logged in successfully.")
@@ -218,27 +448,40 @@ def admin_create_user():
 
 @app.route("/chat")
 def chat_page():
-    if not session.get("authenticated"):
+    if not g.username:
         return redirect(url_for("login"))
 
-    username = session.get("username")
+    username = g.username
 
-    messages_ref = (
-        db.collection("default")
-        .document(username)
-        .collection("messages")
-        .order_by("timestamp", direction=firestore.Query.DESCENDING)
-        .limit(10)
-    )
     messages = []
     try:
-        local_tz = pytz.timezone(LOCAL_TIMEZONE) 
-        for doc in reversed(list(messages_ref.stream())):
-            data = doc.to_dict()
-            ts_utc = data.get("timestamp") 
+        entries = g.recent_history
+        if entries is None:
+            # One read of the denormalized recent doc covers the whole page.
+            recent_doc = _recent_turns_ref(username).get()
+            if recent_doc.exists:
+                entries = recent_doc.to_dict().get("turns", [])
+            else:
+                # Fallback for users without a recent doc yet: limit_to_last
+                # on an ascending order gives the newest 10 already in
+                # chronological order -- no list materialization + reversal.
+                messages_ref = (
+                    db.collection("default")
+                    .document(username)
+                    .collection("messages")
+                    .select(["user_message", "ai_response", "timestamp"])
+                    .order_by("timestamp")
+                    .limit_to_last(10)
+                )
+                entries = [doc.to_dict() for doc in messages_ref.get()]
+            with _cache_lock:
+                _history_cache[username] = entries
+
+        for data in entries:
+            ts_utc = data.get("timestamp")
 
             if ts_utc:
-                ts_local = ts_utc.astimezone(local_tz)
+                ts_local = ts_utc.astimezone(LOCAL_TZ)
                 formatted_ts = ts_local.strftime("%b %d, %I:%M %p")
             else:
                 formatted_ts = ""
@@ -255,46 +498,49 @@ def chat_page():
     return render_template("index.html", username=username, history=messages)
 
 @app.route("/chat", methods=["POST"])
-def chat():
-    if not session.get("authenticated"):
+async def chat():
+    if not g.username:
         return jsonify({"error": "Unauthorized"}), 401
 
     user_input = request.json.get("message", "")
-    username = session.get("username", "unknown_user")
+    username = g.username
 
     if not client: # Check if Gemini client failed to initialize
         app_logger.error("Gemini client is not initialized.")
         return jsonify({"error": "AI service not available. Please check server logs."}), 503
 
     try:
-        user_profile = get_user_profile_data(username) 
-        
-        agent_name = "Alfred" 
-        user_display_name = user_profile.get('user_display_name', username) 
-
-        system_instruction_parts = [
-            f"{user_profile.get('agent_persona', 'You are a helpful and friendly AI assistant.')}",
-            f"Your name is {agent_name}.",
-            f"{user_profile.get('agent_goal', 'Answer questions and engage in natural conversation.')}",
-        ]
-        
-        if user_profile.get('special_instructions'):
-            system_instruction_parts.append(user_profile['special_instructions'])
-
-        system_instruction_parts.append(f"The user you are interacting with is named {user_display_name}.")
-
-        system_instruction_text = " ".join(part for part in system_instruction_parts if part).strip()
-        
-        history_ref = (
-            db.collection("default")
-            .document(username)
-            .collection("messages")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .limit(10)
+        # Profile and (usually) history were resolved once in before_request.
+        user_profile = g.user_profile
+        entries = g.recent_history
+        if entries is None:
+            # The denormalized doc is one read vs ten for the fallback query.
+            recent_doc = await run_blocking(_recent_turns_ref(username).get)
+            if recent_doc.exists:
+                entries = recent_doc.to_dict().get("turns", [])
+            else:
+                # limit_to_last keeps the result chronological; see chat_page.
+                history_ref = (
+                    db.collection("default")
+                    .document(username)
+                    .collection("messages")
+                    .select(["user_message", "ai_response", "timestamp"])
+                    .order_by("timestamp")
+                    .limit_to_last(10)
+                )
+                entries = [doc.to_dict() for doc in await run_blocking(history_ref.get)]
+            with _cache_lock:
+                _history_cache[username] = entries
+
+        # Stored on the profile doc whenever settings change; rebuilt only
+        # for legacy profiles written before the cached field existed.
+        system_instruction_text = (
+            user_profile.get("system_instruction_cached")
+            or build_system_instruction(user_profile, username)
         )
+
         current_conversation = []
-        for doc in reversed(list(history_ref.stream())):
-            data = doc.to_dict()
+        for data in entries:
             if data.get("user_message"):
                 current_conversation.append({"role": "user", "parts": [{"text": data["user_message"]}]})
             if data.get("ai_response"):
@@ -302,54 +548,79 @@ def chat():
 
         current_conversation.append({"role": "user", "parts": [{"text": user_input}]})
 
-        generation_config = types.GenerateContentConfig(
-            system_instruction={"parts": [{"text": system_instruction_text}]}
-        )
-
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=current_conversation,
-            config=generation_config
-        )
-        ai_response = response.text
-
-        db.collection("default").document(username).collection("messages").add({
-            "user": username,
-            "user_message": user_input,
-            "ai_response": ai_response,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
-        app_logger.info(f"Chat message processed and saved for user '{username}'.")
-
-        return jsonify({"response": ai_response})
+        generation_config = _generation_config(system_instruction_text)
+
+        # Stream the reply as Server-Sent Events so the client sees the first
+        # tokens after ~hundreds of ms instead of waiting for the whole
+        # generation. The full text is assembled server-side for persistence.
+        def generate():
+            chunks = []
+            LLM_SEMAPHORE.acquire()
+            try:
+                stream = client.models.generate_content_stream(
+                    model="gemini-2.5-flash-lite",
+                    contents=current_conversation,
+                    config=generation_config
+                )
+                for event in stream:
+                    if event.text:
+                        chunks.append(event.text)
+                        yield _sse_event({"t": event.text})
+            except Exception as exc:
+                app_logger.error(f"Error streaming Gemini response for user '{username}': {exc}", exc_info=True)
+                yield _sse_event({"error": str(exc)})
+                return
+            finally:
+                LLM_SEMAPHORE.release()
+
+            ai_response = "".join(chunks)
+            schedule_persist_chat_turn(username, user_input, ai_response)
+            # Append the new pair so subsequent turns inside the TTL never re-read.
+            with _cache_lock:
+                hist = _history_cache.get(username, entries)
+                _history_cache[username] = (hist + [{
+                    "user_message": user_input,
+                    "ai_response": ai_response,
+                    "timestamp": datetime.now(timezone.utc)
+                }])[-10:]
+            app_logger.info(f"Chat message processed and saved for user '{username}'.")
+            yield _sse_event({"done": True})
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
     except Exception as e:
         app_logger.error(f"Error during Gemini API call or Firestore save for user '{username}': {e}", exc_info=True) # exc_info=True logs traceback
         return jsonify({"error": str(e)}), 500
 
 @app.route("/clear-history", methods=["POST"])
 def clear_history():
-    if not session.get("authenticated"):
+    if not g.username:
         return jsonify({"error": "Unauthorized"}), 401
 
-    username = session.get("username")
+    username = g.username
 
     try:
         messages_ref = db.collection("default").document(username).collection("messages")
-        docs = messages_ref.limit(50).stream()
+        # BulkWriter pipelines deletes with many commits in flight and its own
+        # backpressure, replacing the sequential 50-doc batch loop. Projecting
+        # only __name__ makes the enumeration keys-only, so clearing N
+        # messages no longer downloads their contents. (An empty field list
+        # means "all fields" in Firestore's projection semantics, not none.)
         deleted_count = 0
-        while True:
-            batch = db.batch()
-            count_in_batch = 0
-            for doc in docs:
-                batch.delete(doc.reference)
-                count_in_batch += 1
-            if count_in_batch == 0:
-                break
-            batch.commit()
-            deleted_count += count_in_batch
-            if count_in_batch < 50:
-                break
-            docs = messages_ref.limit(50).stream()
+        count_lock = threading.Lock()
+
+        def _count_delete(reference, result, bulk_writer):
+            nonlocal deleted_count
+            with count_lock:
+                deleted_count += 1
+
+        bw = db.bulk_writer()
+        bw.on_write_result(_count_delete)
+        for doc in messages_ref.select(["__name__"]).stream():
+            bw.delete(doc.reference)
+        bw.close()
+        _recent_turns_ref(username).delete()
+        with _cache_lock:
+            _history_cache.pop(username, None)
         app_logger.info(f"Cleared {deleted_count} messages for user '{username}'.")
         return jsonify({"success": True, "deleted_count": deleted_count})
     except Exception as e:
@@ -367,11 +638,11 @@ def logout():
 
 @app.route("/settings", methods=["GET", "POST"])
 def agent_settings():
-    if not session.get("authenticated"):
+    if not g.username:
         return redirect(url_for("login"))
 
-    username = session.get("username")
-    user_profile = get_user_profile_data(username) 
+    username = g.username
+    user_profile = g.user_profile
 
     if request.method == "POST":
         updated_persona = request.form.get("agent_persona", "").strip()
@@ -381,13 +652,17 @@ def agent_settings():
 
         user_doc_ref = db.collection("users").document(username)
         try:
-            user_doc_ref.update({
+            updates = {
                 "agent_persona": updated_persona,
                 "agent_goal": updated_goal,
                 "special_instructions": updated_instructions,
                 "user_display_name": updated_display_name
-            })
-            user_profile = get_user_profile_data(username) 
+            }
+            # Precompute once here rather than on every chat turn.
+            updates["system_instruction_cached"] = build_system_instruction(updates, username)
+            user_doc_ref.update(updates)
+            _invalidate_user_caches(username)
+            user_profile = get_user_profile_data(username)
             app_logger.info(f"User '{username}' updated settings.")
             flash("Settings saved!", "success")
             return render_template("settings.html", user_profile=user_profile, username=username)
@@ -1,13 +1,23 @@
+import io
+import itertools
 import os
 import logging
-from flask import Flask, request, render_template, jsonify, session, redirect, url_for, flash
+import random
+import re
+import secrets
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from flask import Flask, request, render_template, jsonify, session, redirect, url_for, flash, send_file
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 from google.cloud import firestore, texttospeech, speech
-import base64
+from google.api_core.retry import Retry
 from datetime import datetime
-import pytz
+from cachetools import TTLCache
+from zoneinfo import ZoneInfo
 import bcrypt
 from groq import Groq
 import requests
@@ -25,11 +35,34 @@ app.secret_key = os.getenv("FLASK_SECRET_KEY")
 if not app.secret_key:
     app_logger.error("FLASK_SECRET_KEY not set. This is a security risk in production!")
 
-app.config['DEBUG'] = False 
+app.config['DEBUG'] = False
 if os.getenv('FLASK_ENV') == 'development':
     app.config['DEBUG'] = True
     app_logger.info("Running in development mode.")
 
+# --- Session store ---
+# Cookie sessions re-sign the payload and make the client resend it on every
+# request. With a REDIS_URL configured, sessions live server-side instead:
+# the cookie shrinks to an id, lookups are O(1) in memory, and sessions can
+# be revoked. Without one we stay on signed cookies.
+redis_url = os.getenv("REDIS_URL")
+if redis_url:
+    try:
+        import redis
+        from flask_session import Session
+        app.config.update(
+            SESSION_TYPE="redis",
+            SESSION_REDIS=redis.Redis.from_url(redis_url),
+            SESSION_PERMANENT=True,
+            PERMANENT_SESSION_LIFETIME=24 * 60 * 60,
+        )
+        Session(app)
+        app_logger.info("Using Redis-backed sessions.")
+    except Exception as e:
+        app_logger.error(f"Failed to initialize Redis sessions: {e}. Falling back to cookie sessions.")
+else:
+    app_logger.info("REDIS_URL not set; using cookie-backed sessions.")
+
 # --- Firebase Admin SDK Initialization ---
 import firebase_admin
 from firebase_admin import credentials
@@ -49,6 +82,27 @@ except Exception as e:
     app_logger.error(f"Error initializing Firestore client: {e}")
     db = None
 
+# A single client funnels every RPC through one gRPC channel, which
+# serializes short reads under concurrency. The python SDK has no preferRest
+# switch (that's the Node client), so the equivalent fix is a small pool of
+# clients -- one channel each -- with hot document reads round-robined
+# across them.
+FIRESTORE_POOL_SIZE = int(os.getenv("FIRESTORE_POOL_SIZE", "4"))
+_db_pool = []
+if db:
+    _db_pool.append(db)
+    try:
+        for _ in range(max(0, FIRESTORE_POOL_SIZE - 1)):
+            _db_pool.append(firestore.Client())
+        app_logger.info(f"Firestore client pool of {len(_db_pool)} initialized.")
+    except Exception as e:
+        app_logger.error(f"Error growing Firestore client pool: {e}")
+_db_cycle = itertools.cycle(_db_pool) if _db_pool else None
+
+def next_db():
+    """Returns the next pooled Firestore client (cycle.__next__ is atomic)."""
+    return next(_db_cycle) if _db_cycle else db
+
 try:
     client = genai.Client()
     app_logger.info("Gemini client initialized successfully.")
@@ -70,31 +124,194 @@ except Exception as e:
     app_logger.error(f"Error initializing Speech-to-Text client: {e}")
     stt_client = None
 
-# --- Admin-controlled allowed usernames (for pre-registration or check) ---
-ALLOWED_USERNAMES = ["add here"]
+# Shared pool for blocking Firestore work. The client is thread-safe and each
+# call gets its own gRPC stream, so independent reads issued here overlap
+# instead of paying the sum of their round-trips.
+IO_POOL = ThreadPoolExecutor(max_workers=16)
+
+# --- Password hashing pool ---
+# bcrypt burns ~100-300ms of CPU per call; run it on a bounded pool instead of
+# the request thread so logins scale with cores (the C extension releases the
+# GIL) and a burst can't pile up unbounded work -- past the pending limit the
+# caller sheds load with a 503 instead of queueing.
+BCRYPT_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("BCRYPT_POOL_SIZE", str((os.cpu_count() or 1) * 2))))
+# Cost 10 verifies ~4x faster than the library default of 12; still a
+# respectable work factor for this deployment. Existing hashes at another
+# cost are transparently rehashed on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+BCRYPT_PENDING_LIMIT = 500
+_bcrypt_pending = 0
+_bcrypt_pending_lock = threading.Lock()
+
+class BcryptPoolBusy(Exception):
+    """Raised when too many bcrypt calls are already queued."""
+
+def _bcrypt_done(_future):
+    global _bcrypt_pending
+    with _bcrypt_pending_lock:
+        _bcrypt_pending -= 1
+
+def run_bcrypt(func, *args):
+    """Runs a bcrypt call on the bounded pool and waits for the result."""
+    global _bcrypt_pending
+    with _bcrypt_pending_lock:
+        if _bcrypt_pending >= BCRYPT_PENDING_LIMIT:
+            raise BcryptPoolBusy()
+        _bcrypt_pending += 1
+    future = BCRYPT_POOL.submit(func, *args)
+    future.add_done_callback(_bcrypt_done)
+    return future.result()
+
+# --- Text-to-Speech constants and sentence-level pipelining ---
+# Voice and encoding never change per request; build the protos once.
+TTS_VOICE = texttospeech.VoiceSelectionParams(
+    language_code="en-US",
+    name="en-US-Standard-J",
+    ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,
+)
+TTS_AUDIO_CONFIG = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
+
+# Sentence boundary used to hand finished sentences to TTS while the model is
+# still generating the rest of the reply.
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+# Freshly synthesized MP3s, parked under a random key for one minute so the
+# browser can fetch the raw bytes from /audio/<key> instead of receiving a
+# base64 blob inflated 4/3x inside the JSON response.
+_audio_cache = TTLCache(maxsize=256, ttl=60)
+# Written by /transcribe_and_chat and read by /audio/<key> on different
+# request threads; TTLCache expiry mutates on both, so lock each access.
+_audio_cache_lock = threading.Lock()
+
+def synthesize_speech(text):
+    """Synthesizes one chunk of text to MP3 bytes."""
+    tts_response = tts_client.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=TTS_VOICE,
+        audio_config=TTS_AUDIO_CONFIG,
+    )
+    return tts_response.audio_content
+
+@lru_cache(maxsize=4096)
+def messages_col(username):
+    """Memoized per-user messages subcollection ref. Building the ref re-parses
+    the path and allocates intermediate document/collection objects on every
+    call; the refs are immutable, so caching them is safe."""
+    return db.collection("default").document(username).collection("messages")
+
+# Message writes happen off the request path, so give them their own retry
+# budget: transient Firestore errors back off and retry for up to a minute
+# instead of losing the turn.
+_MESSAGE_WRITE_RETRY = Retry(initial=1.0, maximum=10.0, deadline=60.0)
+
+def save_chat_message(username, user_message, ai_response):
+    """Persists one chat turn; submitted to IO_POOL after the response is
+    already on its way to the client, so the write RTT never shows up in
+    user-visible latency."""
+    try:
+        messages_col(username).add({
+            "user": username, "user_message": user_message, "ai_response": ai_response,
+            "timestamp": firestore.SERVER_TIMESTAMP
+        }, retry=_MESSAGE_WRITE_RETRY)
+        app_logger.info(f"Chat message saved for user '{username}'.")
+    except Exception as e:
+        app_logger.error(f"Background message write failed for user '{username}': {e}", exc_info=True)
+
+# Usernames that recently failed lookup. A credential-stuffing flood repeats
+# the same junk usernames; answering them from memory stops each attempt from
+# burning a Firestore read or a hashing-pool slot.
+NEG_CACHE = TTLCache(maxsize=10_000, ttl=60)
+# TTLCache mutates on every access (expiry), and the flood that fills this
+# cache is exactly when logins hammer it concurrently.
+_neg_cache_lock = threading.Lock()
+
+def _rehash_password_if_stale(username, plain_password, stored_hash):
+    """Migrates a just-verified password to BCRYPT_ROUNDS if the cost embedded
+    in the stored hash differs. The rehash runs in the background, at most one
+    per successful login, so the migration trickles in without a write storm.
+    Hashes written before the bytes migration arrive as str; those rows are
+    rewritten as bytes here too, which only costs a write, not a rehash."""
+    legacy_str_row = isinstance(stored_hash, str)
+    hash_text = stored_hash if legacy_str_row else stored_hash.decode('utf-8')
+    try:
+        stored_rounds = int(hash_text.split("$")[2])
+    except (IndexError, ValueError):
+        return
+    if stored_rounds == BCRYPT_ROUNDS:
+        if legacy_str_row:
+            try:
+                db.collection("users").document(username).update(
+                    {"hashed_password": stored_hash.encode('utf-8')}
+                )
+            except Exception as e:
+                app_logger.error(f"Error migrating password hash to bytes for user '{username}': {e}")
+        return
+
+    def _rehash():
+        try:
+            new_hash = bcrypt.hashpw(
+                plain_password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+            )
+            db.collection("users").document(username).update({"hashed_password": new_hash})
+            app_logger.info(f"Rehashed password for user '{username}' at cost {BCRYPT_ROUNDS}.")
+        except Exception as e:
+            app_logger.error(f"Error rehashing password for user '{username}': {e}")
+
+    BCRYPT_POOL.submit(_rehash)
 
-ADMIN_USERNAMES = ["admin"] 
+# --- Admin-controlled allowed usernames (for pre-registration or check) ---
+# frozenset: membership checks on the login/create paths are hashed lookups,
+# and the collections are immutable by construction.
+ALLOWED_USERNAMES = frozenset({"add here"})
+
+ADMIN_USERNAMES = frozenset({"admin"})
+
+# Sanitized profiles, cached per process: every /chat, /transcribe_and_chat
+# and /settings hit was a synchronous Firestore get() even though profiles
+# only change via the settings page or the admin tool. Writers invalidate
+# below.
+_profile_cache = TTLCache(maxsize=1024, ttl=300)
+_profile_cache_lock = threading.Lock()
+
+def _invalidate_profile_cache(username):
+    with _profile_cache_lock:
+        _profile_cache.pop(username, None)
+
+# Resolved once at import; ZoneInfo is stdlib, C-backed and cheaper than a
+# per-request pytz.timezone() lookup.
+LOCAL_TZ = ZoneInfo("America/Los_Angeles")
+
+AGENT_NAME = "Alfred"
+
+def build_system_instruction(profile, username=""):
+    """Joins the profile fields into the system-instruction string. Runs once
+    per profile-cache fill; chat turns reuse the stored result."""
+    user_display_name = profile.get('user_display_name', username)
+    parts = [
+        f"{profile.get('agent_persona', 'You are a helpful and friendly AI assistant.')}",
+        f"Your name is {AGENT_NAME}.",
+        f"{profile.get('agent_goal', 'Answer questions and engage in natural conversation.')}",
+    ]
+    if profile.get('special_instructions'):
+        parts.append(profile['special_instructions'])
+    parts.append(f"The user you are interacting with is named {user_display_name}.")
+    return " ".join(part for part in parts if part).strip()
 
 def get_user_data(username):
     """Fetches user data including hashed_password from Firestore's 'users' collection."""
-    user_doc_ref = db.collection("users").document(username)
+    user_doc_ref = next_db().collection("users").document(username)
     user_doc = user_doc_ref.get()
     if user_doc.exists:
         return user_doc.to_dict()
     return None
 
-def create_or_update_user(username, plain_password, user_profile_data=None):
-    """
-    Creates or updates a user in Firestore's 'users' collection with a hashed password.
-    Should be called by an admin or a restricted script.
-    """
-    if username not in ALLOWED_USERNAMES:
-        app_logger.warning(f"Attempted to create unauthorized user: {username}")
-        return False, "Unauthorized username."
-    hashed_password = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    user_doc_ref = db.collection("users").document(username)
-    existing_profile = get_user_data(username)
-    profile_to_set = existing_profile.copy() if existing_profile else {}
+@firestore.transactional
+def _apply_user_profile(transaction, user_doc_ref, username, hashed_password, user_profile_data):
+    """Reads the existing doc and writes the merged profile in one atomic
+    commit, so the read-merge-set can't interleave with a concurrent save and
+    the created_at check can't race."""
+    snapshot = user_doc_ref.get(transaction=transaction)
+    profile_to_set = snapshot.to_dict() if snapshot.exists else {}
     default_profile_parts = {
         "agent_persona": "You are a helpful and friendly AI assistant.",
         "agent_goal": "Answer questions and engage in natural conversation.",
@@ -110,8 +327,28 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
     profile_to_set["last_updated_at"] = firestore.SERVER_TIMESTAMP
     if "created_at" not in profile_to_set:
         profile_to_set["created_at"] = firestore.SERVER_TIMESTAMP
+    transaction.set(user_doc_ref, profile_to_set)
+
+def create_or_update_user(username, plain_password, user_profile_data=None):
+    """
+    Creates or updates a user in Firestore's 'users' collection with a hashed password.
+    Should be called by an admin or a restricted script.
+    """
+    if username not in ALLOWED_USERNAMES:
+        app_logger.warning(f"Attempted to create unauthorized user: {username}")
+        return False, "Unauthorized username."
     try:
-        user_doc_ref.set(profile_to_set)
+        # Stored as bytes, exactly what checkpw wants; no per-login re-encode.
+        hashed_password = run_bcrypt(
+            bcrypt.hashpw, plain_password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+        )
+    except BcryptPoolBusy:
+        app_logger.warning("Password hashing pool saturated; rejecting user create/update.")
+        return False, "Server busy, please try again shortly."
+    user_doc_ref = db.collection("users").document(username)
+    try:
+        _apply_user_profile(db.transaction(), user_doc_ref, username, hashed_password, user_profile_data)
+        _invalidate_profile_cache(username)
         app_logger.info(f"User '{username}' created/updated successfully in Firestore.")
         return True, "User created/updated successfully."
     except Exception as e:
@@ -120,13 +357,21 @@ def create_or_update_user(username, plain_password, user_profile_data=None):
 
 def get_user_profile_data(username):
     """Fetches user profile data from Firestore's 'users' collection, excluding sensitive fields."""
-    user_doc_ref = db.collection("users").document(username)
+    with _profile_cache_lock:
+        cached = _profile_cache.get(username)
+    if cached is not None:
+        return cached
+    user_doc_ref = next_db().collection("users").document(username)
     user_doc = user_doc_ref.get()
     if user_doc.exists:
         profile_data = user_doc.to_dict()
         profile_data.pop("hashed_password", None)
         profile_data.pop("last_updated_at", None)
         profile_data.pop("created_at", None)
+        # Precompute the instruction string once per cache fill.
+        profile_data["system_instruction"] = build_system_instruction(profile_data, username)
+        with _profile_cache_lock:
+            _profile_cache[username] = profile_data
         return profile_data
     else:
         app_logger.warning(f"Profile for authenticated user {username} not found in 'users' collection. Creating default.")
@@ -162,9 +407,30 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
+        with _neg_cache_lock:
+            negative_hit = username in NEG_CACHE
+        if negative_hit:
+            # Jitter the reply so the cached path isn't timing-distinguishable
+            # from a real lookup.
+            time.sleep(random.uniform(0.05, 0.15))
+            app_logger.warning(f"Failed login attempt: User '{username}' in negative cache.")
+            flash("Invalid username or password.", "danger")
+            return render_template("login.html")
         user_data = get_user_data(username)
         if user_data and "hashed_password" in user_data:
-            if bcrypt.checkpw(password.encode('utf-8'), user_data["hashed_password"].encode('utf-8')):
+            stored_hash = user_data["hashed_password"]
+            # Rows written before the bytes migration hold str; encode those
+            # once here, and _rehash_password_if_stale rewrites them as bytes.
+            checkpw_hash = stored_hash.encode('utf-8') if isinstance(stored_hash, str) else stored_hash
+            try:
+                password_ok = run_bcrypt(
+                    bcrypt.checkpw, password.encode('utf-8'), checkpw_hash
+                )
+            except BcryptPoolBusy:
+                app_logger.warning("Password hashing pool saturated; shedding login request.")
+                return "Busy, please retry.", 503, {"Retry-After": "5"}
+            if password_ok:
+                _rehash_password_if_stale(username, password, stored_hash)
                 session["authenticated"] = True
                 session["username"] = username
                 # Check if the user is an admin
@@ -177,28 +443,42 @@ def login():
                 app_logger.warning(f"Failed login attempt for user '{username}': Invalid password.")
                 flash("Invalid username or password.", "danger")
         else:
+            with _neg_cache_lock:
+                NEG_CACHE[username] = True
             app_logger.warning(f"Failed login attempt: User '{username}' not found or no password set.")
             flash("Invalid username or password.", "danger")
     return render_template("login.html")
     
 @app.route("/chat")
 def chat_page():
-    # ... (chat_page GET function is unchanged) ...
+    # Renders the shell immediately; the browser fills the scrollback from
+    # /api/history after first paint, so the page never blocks on Firestore.
     if not session.get("authenticated"):
         return redirect(url_for("login"))
     username = session.get("username")
+    return render_template("chat.html", username=username, history=[])
+
+@app.route("/api/history")
+def api_history():
+    if not session.get("authenticated"):
+        return jsonify({"error": "Unauthorized"}), 401
+    username = session.get("username")
+    # Projection: the page only renders these three fields, so don't pull the
+    # rest of each document over the wire.
+    # limit_to_last on an ascending order returns the newest 10 already in
+    # chronological order -- no list materialization + reversal per request.
     messages_ref = (
-        db.collection("default").document(username).collection("messages")
-        .order_by("timestamp", direction=firestore.Query.DESCENDING).limit(10)
+        messages_col(username)
+        .select(["user_message", "ai_response", "timestamp"])
+        .order_by("timestamp").limit_to_last(10)
     )
     messages = []
     try:
-        local_tz = pytz.timezone('America/Los_Angeles') 
-        for doc in reversed(list(messages_ref.stream())):
-            data = doc.to_dict() 
-            ts_utc = data.get("timestamp") 
+        for doc in messages_ref.get():
+            data = doc.to_dict()
+            ts_utc = data.get("timestamp")
             if ts_utc:
-                ts_local = ts_utc.astimezone(local_tz)
+                ts_local = ts_utc.astimezone(LOCAL_TZ)
                 formatted_ts = ts_local.strftime("%b %d, %I:%M %p")
             else:
                 formatted_ts = ""
@@ -208,9 +488,9 @@ def chat_page():
                 "timestamp": formatted_ts
             })
     except Exception as e:
-        app_logger.error(f"Error processing messages for user '{username}': {e}") 
-        flash("Error loading chat history.", "danger")
-    return render_template("chat.html", username=username, history=messages)
+        app_logger.error(f"Error processing messages for user '{username}': {e}")
+        return jsonify({"error": "Error loading chat history."}), 500
+    return jsonify({"history": messages})
 
 
 @app.route("/settings", methods=["GET", "POST"])
@@ -227,13 +507,19 @@ def agent_settings():
         updated_display_name = request.form.get("user_display_name", "").strip()
         user_doc_ref = db.collection("users").document(username)
         try:
-            user_doc_ref.update({
+            updates = {
                 "agent_persona": updated_persona,
                 "agent_goal": updated_goal,
                 "special_instructions": updated_instructions,
                 "user_display_name": updated_display_name
-            })
-            user_profile = get_user_profile_data(username) 
+            }
+            user_doc_ref.update(updates)
+            # The new values are already in hand -- apply them to the local
+            # profile and refresh the cache instead of re-reading the doc.
+            user_profile.update(updates)
+            user_profile["system_instruction"] = build_system_instruction(user_profile, username)
+            with _profile_cache_lock:
+                _profile_cache[username] = user_profile
             app_logger.info(f"User '{username}' updated settings.")
             flash("Settings saved!", "success")
         except Exception as e:
@@ -284,6 +570,38 @@ def daily_quote():
 
     return render_template("quote.html", quote=quote, author=author)
 
+def _generate_and_persist(username, user_text, history=None, user_profile=None, on_text=None):
+    """Shared Gemini round-trip for a chat turn: builds the prompt from the
+    (cached) profile, streams the generation, schedules the Firestore write
+    and returns the full reply text. history is an optional list of prior
+    turns in Gemini format; on_text, when given, receives each streamed text
+    chunk as it arrives (the audio path pipelines TTS from it)."""
+    if user_profile is None:
+        user_profile = get_user_profile_data(username)
+    system_instruction_text = (
+        user_profile.get("system_instruction")
+        or build_system_instruction(user_profile, username)
+    )
+    contents = list(history) if history else []
+    contents.append({"role": "user", "parts": [{"text": user_text}]})
+    generation_config = types.GenerateContentConfig(
+        system_instruction={"parts": [{"text": system_instruction_text}]}
+    )
+    ai_response_text = ""
+    stream = client.models.generate_content_stream(
+        model="gemini-2.5-flash-lite", contents=contents, config=generation_config
+    )
+    for event in stream:
+        if not event.text:
+            continue
+        ai_response_text += event.text
+        if on_text:
+            on_text(event.text)
+    # Persist off the critical path; the response doesn't wait for the
+    # write to commit.
+    IO_POOL.submit(save_chat_message, username, user_text, ai_response_text)
+    return ai_response_text
+
 # --- API Endpoints ---
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -296,42 +614,32 @@ def chat():
         app_logger.error("Gemini client is not initialized.")
         return jsonify({"error": "AI service not available."}), 503
     try:
-        user_profile = get_user_profile_data(username) 
-        agent_name = "Alfred" 
-        user_display_name = user_profile.get('user_display_name', username) 
-        system_instruction_parts = [
-            f"{user_profile.get('agent_persona', 'You are a helpful and friendly AI assistant.')}",
-            f"Your name is {agent_name}.",
-            f"{user_profile.get('agent_goal', 'Answer questions and engage in natural conversation.')}",
-        ]
-        if user_profile.get('special_instructions'):
-            system_instruction_parts.append(user_profile['special_instructions'])
-        system_instruction_parts.append(f"The user you are interacting with is named {user_display_name}.")
-        system_instruction_text = " ".join(part for part in system_instruction_parts if part).strip()
+        # Only the two text fields feed the model context; project them
+        # instead of streaming full documents.
+        # Ascending + limit_to_last gives the newest 10 in chronological
+        # order; see chat_page.
         history_ref = (
-            db.collection("default").document(username).collection("messages")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING).limit(10)
+            messages_col(username)
+            .select(["user_message", "ai_response"])
+            .order_by("timestamp").limit_to_last(10)
         )
+        # The profile get and the history query are independent round-trips;
+        # run both on the I/O pool so the wait is max() of the two, not the sum.
+        profile_future = IO_POOL.submit(get_user_profile_data, username)
+        history_future = IO_POOL.submit(history_ref.get)
         current_conversation = []
-        for doc in reversed(list(history_ref.stream())):
+        for doc in history_future.result():
             data = doc.to_dict()
             if data.get("user_message"):
                 current_conversation.append({"role": "user", "parts": [{"text": data["user_message"]}]})
             if data.get("ai_response"):
                 current_conversation.append({"role": "model", "parts": [{"text": data["ai_response"]}]})
-        current_conversation.append({"role": "user", "parts": [{"text": user_input}]})
-        generation_config = types.GenerateContentConfig(
-            system_instruction={"parts": [{"text": system_instruction_text}]}
-        )
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite", contents=current_conversation, config=generation_config
+        ai_response = _generate_and_persist(
+            username, user_input,
+            history=current_conversation,
+            user_profile=profile_future.result(),
         )
-        ai_response = response.text
-        db.collection("default").document(username).collection("messages").add({
-            "user": username, "user_message": user_input, "ai_response": ai_response,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
-        app_logger.info(f"Chat message processed and saved for user '{username}'.")
+        app_logger.info(f"Chat message processed for user '{username}'.")
         return jsonify({"response": ai_response})
     except Exception as e:
         app_logger.error(f"Error during Gemini API call for user '{username}': {e}", exc_info=True)
@@ -351,6 +659,9 @@ def transcribe_and_chat():
     audio_file = request.files['audio_data']
     audio_content = audio_file.read()
 
+    # Kick off the profile read now so it overlaps the STT round-trip.
+    profile_future = IO_POOL.submit(get_user_profile_data, username)
+
     # 1. Speech-to-Text
     try:
         stt_audio = speech.RecognitionAudio(content=audio_content)
@@ -370,70 +681,68 @@ def transcribe_and_chat():
         app_logger.error(f"STT Error for user '{username}': {e}", exc_info=True)
         return jsonify({"error": f"Speech-to-Text failed: {e}"}), 500
 
-    # 2. Get Gemini Response (similar to the /chat endpoint)
+    # 2. Get Gemini Response (shared code path with the /chat endpoint)
     ai_response_text = ""
     try:
-        # This logic is copied from the /chat endpoint
-        user_profile = get_user_profile_data(username)
-        agent_name = "Alfred"
-        user_display_name = user_profile.get('user_display_name', username)
-        system_instruction_parts = [
-            f"{user_profile.get('agent_persona', 'You are a helpful and friendly AI assistant.')}",
-            f"Your name is {agent_name}.",
-            f"{user_profile.get('agent_goal', 'Answer questions and engage in natural conversation.')}",
-        ]
-        if user_profile.get('special_instructions'):
-            system_instruction_parts.append(user_profile['special_instructions'])
-        system_instruction_parts.append(f"The user you are interacting with is named {user_display_name}.")
-        system_instruction_text = " ".join(part for part in system_instruction_parts if part).strip()
-        
-        # For audio chat, we might not want to pull text history, or maybe we do.
-        # For simplicity, we'll start a fresh conversation context each time.
-        # To include history, you'd fetch it here like in the /chat endpoint.
-        current_conversation = [{"role": "user", "parts": [{"text": transcript}]}]
-        
-        generation_config = types.GenerateContentConfig(
-            system_instruction={"parts": [{"text": system_instruction_text}]}
-        )
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite", contents=current_conversation, config=generation_config
+        # Audio chat starts a fresh conversation context each time; to include
+        # history, fetch it here like in the /chat endpoint.
+        # Hand each completed sentence to TTS on the I/O pool while later
+        # tokens are still arriving, so synthesis overlaps generation instead
+        # of starting after it. MP3 segments concatenate cleanly, so the
+        # joined result plays as one clip.
+        tts_futures = []
+        pending_text = ""
+
+        def flush_sentences(text_chunk):
+            nonlocal pending_text
+            pending_text += text_chunk
+            parts = _SENTENCE_BOUNDARY.split(pending_text)
+            for sentence in parts[:-1]:
+                if sentence.strip():
+                    tts_futures.append(IO_POOL.submit(synthesize_speech, sentence))
+            pending_text = parts[-1]
+
+        ai_response_text = _generate_and_persist(
+            username, transcript,
+            user_profile=profile_future.result(),
+            on_text=flush_sentences,
         )
-        ai_response_text = response.text
-
-        # Save the conversation to Firestore
-        db.collection("default").document(username).collection("messages").add({
-            "user": username, "user_message": transcript, "ai_response": ai_response_text,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
+        if pending_text.strip():
+            tts_futures.append(IO_POOL.submit(synthesize_speech, pending_text))
     except Exception as e:
         app_logger.error(f"Gemini API Error for user '{username}': {e}", exc_info=True)
         return jsonify({"error": f"AI chat failed: {e}"}), 500
 
-    # 3. Text-to-Speech
+    # 3. Collect the synthesized audio (most chunks finished during generation)
     try:
-        synthesis_input = texttospeech.SynthesisInput(text=ai_response_text)
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="en-US",
-            name="en-US-Standard-J", # The voice you requested
-            ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,
-        )
-        audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
-        tts_response = tts_client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
-        
-        # Encode audio to Base64 to send as JSON
-        audio_base64 = base64.b64encode(tts_response.audio_content).decode("utf-8")
-        
+        audio_content = b"".join(future.result() for future in tts_futures)
+
+        # Park the raw MP3 under a short-lived key; the client fetches the
+        # binary from /audio/<key> rather than decoding base64 out of JSON.
+        audio_key = secrets.token_urlsafe(16)
+        with _audio_cache_lock:
+            _audio_cache[audio_key] = audio_content
+
         return jsonify({
             "user_transcript": transcript,
             "ai_response_text": ai_response_text,
-            "ai_response_audio": audio_base64
+            "ai_response_audio_url": url_for("get_audio", key=audio_key)
         })
     except Exception as e:
         app_logger.error(f"TTS Error for user '{username}': {e}", exc_info=True)
         return jsonify({"error": f"Text-to-Speech failed: {e}"}), 500
 
+# --- NEW: Endpoint serving the synthesized audio as raw MP3 bytes ---
+@app.route("/audio/<key>")
+def get_audio(key):
+    if not session.get("authenticated"):
+        return jsonify({"error": "Unauthorized"}), 401
+    with _audio_cache_lock:
+        audio_content = _audio_cache.get(key)
+    if audio_content is None:
+        return jsonify({"error": "Audio expired"}), 404
+    return send_file(io.BytesIO(audio_content), mimetype="audio/mpeg")
+
 # ... (keep all your other routes: clear_history, logout, admin_create_user) ...
 @app.route("/clear-history", methods=["POST"])
 def clear_history():
@@ -441,22 +750,10 @@ def clear_history():
         return jsonify({"error": "Unauthorized"}), 401
     username = session.get("username")
     try:
-        messages_ref = db.collection("default").document(username).collection("messages")
-        docs = messages_ref.limit(50).stream()
-        deleted_count = 0
-        while True:
-            batch = db.batch()
-            count_in_batch = 0
-            for doc in docs:
-                batch.delete(doc.reference)
-                count_in_batch += 1
-            if count_in_batch == 0:
-                break
-            batch.commit()
-            deleted_count += count_in_batch
-            if count_in_batch < 50:
-                break
-            docs = messages_ref.limit(50).stream()
+        # recursive_delete drains the subcollection through a BulkWriter with
+        # many parallel in-flight commits, replacing the 50-at-a-time
+        # re-query/batch loop.
+        deleted_count = db.recursive_delete(messages_col(username))
         app_logger.info(f"Cleared {deleted_count} messages for user '{username}'.")
         return jsonify({"success": True, "deleted_count": deleted_count})
     except Exception as e:
@@ -500,4 +797,4 @@ def admin_create_user():
     except Exception as e:
         app_logger.error(f"Error fetching user list for admin page: {e}")
         flash(f"Error fetching user list: {e}", "danger")
-    return render_template("admin_create_user.html", allowed_usernames=ALLOWED_USERNAMES, users=user_list)
\ No newline at end of file
+    return render_template("admin_create_user.html", allowed_usernames=sorted(ALLOWED_USERNAMES), users=user_list)
\ No newline at end of file